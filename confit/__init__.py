@@ -253,7 +253,14 @@ class Task(ButOnce, ClassHierarchyRoot):
             code = [code]
         return checks + [self.pre if len(self.deps()) > 0 else None] + code
 
-    def script(self, verbose=False, debug=False, locale='en_US.UTF-8'):
+    def script(self, verbose=False, debug=False, locale='en_US.UTF-8',
+               stages=()):
+        """Generate a Bash script for this task and all its dependencies.
+
+        Each of the ``stages`` is called, in order, on the collection of tasks
+        to be declared and returns the collection of (possibly rewritten)
+        declarations that should appear in the script instead.
+        """
         def all_defs(task):
             subs = []
             if isinstance(task, Wrapper):
@@ -263,6 +270,8 @@ class Task(ButOnce, ClassHierarchyRoot):
             return itertools.chain(subs, *[all_defs(t) for t in subs])
 
         tasks = set([self]) | self.subs
+        for stage in stages:
+            tasks = stage(tasks)
         decls = [t.decls for t in sorted(tasks, key=Named.components)]
         return textwrap.dedent("""
             #!/bin/bash
@@ -4,13 +4,17 @@ definitions. If you're writing a system, configuration you probably want this
 module.
 """
 
+import base64
 import binascii
+import collections
+import gzip
 import itertools
 import os
 import pipes
 import re
 import StringIO
 import sys
+import tarfile
 import textwrap
 import types
 import uu
@@ -51,6 +55,36 @@ class WriteFile(Task):
             ['chown', self.owner, self.path] if self.owner else None
         ]
 
+    @property
+    def bundleable(self):
+        """Whether this file can be written from a ``Bundle``.
+
+        Files with dependencies, without content, which must not create their
+        directory or which have relative or unnormalized paths are written one
+        at a time, as are files of subclasses that change how they are written.
+        """
+        methods = ['code', 'create', 'mkdir_p', 'checks', 'body', 'decls',
+                   'data']
+        overridden = [m for m in methods
+                      if getattr(type(self), m) != getattr(WriteFile, m)]
+        return (self.mkdir and self.content is not None and
+                len(overridden) == 0 and len(self.deps()) == 0 and
+                os.path.isabs(self.path) and
+                os.path.normpath(self.path) == self.path)
+
+    @property
+    def data(self):
+        """The bytes that ``.create()`` leaves in the file.
+
+        Unicode content is encoded as UTF-8, to match the script's locale.
+        """
+        content = self.content
+        if isinstance(content, unicode):
+            content = content.encode('utf-8')
+        if '\0' not in content and '\t' not in content:
+            return content + '\n'                    # HEREDOCs end in newline
+        return content
+
     def mkdir_p(self):
         if self.mkdir:
             dirname = os.path.dirname(self.path)
@@ -84,6 +118,157 @@ class WriteFile(Task):
             return '\n\t'.join(text.split('\n'))
 
 
+class Bundle(Task):
+    """Write many files at once, from a single compressed tar payload.
+
+    Much like a wrapper, a bundle is called on a collection of ``WriteFile``
+    tasks to gather them. The payload is extracted in one pass to a staging
+    directory and each file is written into place with ``cat``, after which
+    modes and owners are set with one ``chmod`` or ``chown`` per distinct mode
+    or owner.
+    """
+    def __init__(self):
+        pass
+
+    def __call__(self, *files):
+        chained = []
+        for f in files:
+            if isinstance(f, WriteFile):
+                chained += [f]
+            else:
+                chained += list(f)
+
+        for f in chained:
+            self._callspec_labels |= set([f._callspec])
+
+        self.files = sorted(chained, key=lambda f: f.path)
+        return self
+
+    def code(self):
+        modes, owners = {}, {}
+        for f in self.files:
+            if f.mode:
+                modes.setdefault(f.mode, []).append(f.path)
+            if f.owner:
+                owners.setdefault(f.owner, []).append(f.path)
+        chmods = [['chmod', k] + paths for k, paths in sorted(modes.items())]
+        chowns = [['chown', k] + paths for k, paths in sorted(owners.items())]
+        return [self.extract()] + chmods + chowns
+
+    @property
+    def payload(self):
+        """Gzipped tarball of all files, with paths relative to the root.
+
+        Timestamps are zeroed, so that the script is the same from run to run.
+        """
+        o = StringIO.StringIO()
+        gz = gzip.GzipFile(fileobj=o, mode='wb', mtime=0)
+        tar = tarfile.open(fileobj=gz, mode='w')
+        for f in self.files:
+            data = f.data
+            info = tarfile.TarInfo(f.path.lstrip('/'))
+            info.size, info.mode, info.mtime = len(data), 0666, 0
+            tar.addfile(info, StringIO.StringIO(data))
+        tar.close()
+        gz.close()
+        return o.getvalue()
+
+    def extract(self):
+        """Bash fragment unpacking all files and writing them into place.
+
+        The payload is unpacked to a staging directory, which is removed
+        however the subshell exits. Directories are then created with one
+        ``mkdir -p`` and each file is written with ``cat``, just as by
+        ``WriteFile.create()``: existing files keep their mode, owner and
+        other metadata and symlinks -- to files or directories, dangling or
+        not -- are written through.
+        """
+        dirs = sorted(set(os.path.dirname(f.path) for f in self.files))
+        template = ('( set -o errexit -o nounset -o pipefail\n'
+                    '  staging="$(mktemp -d)"\n'
+                    '  trap \'rm -rf "$staging"\' EXIT\n'
+                    '  base64 --decode <<-\\b64 |\n'
+                    '{content}b64\n'
+                    '  tar -xz --no-same-owner --no-same-permissions'
+                    ' -C "$staging"\n'
+                    '  mkdir -p {dirs}\n'
+                    '  for path in {paths}\n'
+                    '  do cat "$staging$path" > "$path"\n'
+                    '  done\n'
+                    ')')
+        text = template.format(content=base64.encodestring(self.payload),
+                               dirs=' '.join(pipes.quote(d) for d in dirs),
+                               paths=' '.join(pipes.quote(f.path)
+                                              for f in self.files))
+        return '\n\t'.join(text.split('\n'))
+
+
+class Bundled(Named):
+    """Stands in for a bundled ``WriteFile``, calling its ``Bundle`` instead.
+
+    The file's own sentinel is still checked and set.
+    """
+    def __init__(self, task, bundle):
+        self.__dict__.update(locals())
+        del self.self
+
+    @property
+    def name(self):
+        return self.task.name
+
+    @property
+    def decls(self):
+        body = self.task.checks + [self.bundle.call]
+        body = '\n'.join(Bash.fmt(item) for item in body)
+        return ['\n'.join(['function %s {' % self.name, body, '}'])]
+
+
+def bundle_files(tasks):
+    """Script stage gathering ``WriteFile`` tasks that are ready together.
+
+    All bundleable files among a task's dependencies are written from one
+    ``Bundle``: the first of them to be called extracts all of them. A task's
+    dependencies have no order among themselves -- ``.deps()`` is a set -- so
+    a bundle may be written before or after any of its files' siblings. Files
+    called from more than one place, run within a wrapper or sharing a path
+    with another file keep their own code, since bundling them could change
+    the order in which they are written relative to other tasks.
+
+    .. code-block:: python
+
+        task.script(stages=[bundle_files])
+    """
+    tasks = set(tasks)
+    calls, paths, wrapped = collections.Counter(), collections.Counter(), set()
+    for task in tasks:
+        if isinstance(task, Wrapper):
+            calls.update(task.others)
+            for other in task.others:
+                wrapped |= set([other])
+                wrapped |= other.subs if isinstance(other, Task) else set()
+        if isinstance(task, Task):
+            calls.update(task.deps())
+        if isinstance(task, WriteFile):
+            paths[task.path] += 1
+
+    def ready(task):
+        return (isinstance(task, WriteFile) and task.bundleable and
+                calls[task] == 1 and paths[task.path] == 1 and
+                task not in wrapped)
+
+    bundled = {}
+    for task in sorted(tasks, key=Named.components):
+        if not isinstance(task, Task):
+            continue
+        files = [dep for dep in task.deps() if ready(dep)]
+        if len(files) > 1:
+            bundle = Bundle()(files)
+            tasks.add(bundle)
+            bundled.update((f, bundle) for f in files)
+
+    return [Bundled(t, bundled[t]) if t in bundled else t for t in tasks]
+
+
 class TZ(Task):
     """Set system timezone."""
     def __init__(self, tz='UTC'):
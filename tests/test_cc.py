@@ -0,0 +1,191 @@
+import base64
+import os
+import re
+import shutil
+import StringIO
+import subprocess
+import tarfile
+import tempfile
+import unittest
+
+from confit import cc
+
+
+def files(n, **kwargs):
+    return [cc.WriteFile('/etc/confit/%d.conf' % i, 'n = %d' % i, **kwargs)
+            for i in range(n)]
+
+
+class Reloaded(cc.WriteFile):
+    def code(self):
+        return super(Reloaded, self).code() + [['service', 'nginx', 'reload']]
+
+
+class Role(cc.Task):
+    def __init__(self, n):
+        self.__dict__.update(locals())
+        del self.self
+
+    def deps(self):
+        return set(files(self.n) + [cc.Apt('nginx'), cc.TZ()])
+
+
+class TestWriteFile(unittest.TestCase):
+    def test_data_text_ends_in_newline(self):
+        self.assertEqual(cc.WriteFile('/a', 'text').data, 'text\n')
+
+    def test_data_binary_is_verbatim(self):
+        self.assertEqual(cc.WriteFile('/a', 'b\0\tn').data, 'b\0\tn')
+
+    def test_data_unicode_is_utf8(self):
+        self.assertEqual(cc.WriteFile('/a', u'caf\xe9').data, 'caf\xc3\xa9\n')
+
+    def test_bundleable(self):
+        self.assertTrue(cc.WriteFile('/a/b', 'x').bundleable)
+        self.assertFalse(cc.WriteFile('a/b', 'x').bundleable)
+        self.assertFalse(cc.WriteFile('/a/../b', 'x').bundleable)
+        self.assertFalse(cc.WriteFile('/a/b').bundleable)
+        self.assertFalse(cc.WriteFile('/a/b', 'x', mkdir=False).bundleable)
+
+    def test_subclass_changing_code_is_not_bundleable(self):
+        self.assertFalse(Reloaded('/a/b', 'x').bundleable)
+
+
+class TestBundle(unittest.TestCase):
+    def test_payload_round_trips(self):
+        written = files(3) + [cc.WriteFile('/bin/x', 'b\0\tn', mode='0755')]
+        payload = cc.Bundle()(written).payload
+        tar = tarfile.open(fileobj=StringIO.StringIO(payload), mode='r:gz')
+        unpacked = dict((i.name, tar.extractfile(i).read()) for i in tar)
+        self.assertEqual(unpacked,
+                         dict((f.path.lstrip('/'), f.data) for f in written))
+
+    def test_payload_sizes_are_bytes(self):
+        payload = cc.Bundle()(cc.WriteFile('/a', u'caf\xe9'),
+                              cc.WriteFile('/b', 'b')).payload
+        tar = tarfile.open(fileobj=StringIO.StringIO(payload), mode='r:gz')
+        self.assertEqual(tar.extractfile('a').read(), 'caf\xc3\xa9\n')
+
+    def test_payload_is_stable(self):
+        self.assertEqual(cc.Bundle()(files(3)).payload,
+                         cc.Bundle()(files(3)).payload)
+
+    def test_extract_embeds_payload(self):
+        bundle = cc.Bundle()(files(3))
+        encoded = re.search(r'<<-\\b64 \|\n(.*)\n\tb64', bundle.extract(),
+                            re.DOTALL).group(1)
+        self.assertEqual(base64.decodestring(encoded.replace('\t', '')),
+                         bundle.payload)
+
+    def test_modes_and_owners_are_batched(self):
+        bundle = cc.Bundle()(files(3, mode='0600', owner='www-data'))
+        paths = sorted(f.path for f in files(3))
+        self.assertEqual(bundle.code()[1:], [['chmod', '0600'] + paths,
+                                             ['chown', 'www-data'] + paths])
+
+
+class TestBundleScript(unittest.TestCase):
+    def setUp(self):
+        self.root = os.path.realpath(tempfile.mkdtemp())
+        self.tmp = os.path.join(self.root, 'tmp')
+        os.mkdir(self.tmp)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def run_bundle(self, *files):
+        env = dict(os.environ, TMPDIR=self.tmp)
+        script = cc.Bundle()(files).script()
+        p = subprocess.Popen(['bash'], stdin=subprocess.PIPE,
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                             env=env)
+        p.communicate(script)
+        return p.returncode
+
+    def path(self, *parts):
+        return os.path.join(self.root, *parts)
+
+    def read(self, *parts):
+        with open(self.path(*parts)) as h:
+            return h.read()
+
+    def test_writes_through_symlinked_directory(self):
+        os.makedirs(self.path('usr', 'lib'))
+        os.symlink('usr/lib', self.path('lib'))
+        self.assertEqual(self.run_bundle(
+            cc.WriteFile(self.path('lib', 'systemd', 'foo.service'), 'foo'),
+            cc.WriteFile(self.path('etc', 'bar.conf'), 'bar')), 0)
+        self.assertTrue(os.path.islink(self.path('lib')))
+        self.assertEqual(self.read('usr', 'lib', 'systemd', 'foo.service'),
+                         'foo\n')
+        self.assertEqual(self.read('etc', 'bar.conf'), 'bar\n')
+
+    def test_writes_through_symlinked_files(self):
+        os.symlink('real', self.path('link'))
+        os.symlink('missing', self.path('dangling'))
+        self.assertEqual(self.run_bundle(
+            cc.WriteFile(self.path('link'), 'link'),
+            cc.WriteFile(self.path('dangling'), 'dangling')), 0)
+        self.assertTrue(os.path.islink(self.path('link')))
+        self.assertEqual(self.read('real'), 'link\n')
+        self.assertEqual(self.read('missing'), 'dangling\n')
+
+    def test_keeps_mode_of_existing_file(self):
+        with open(self.path('secret'), 'w') as h:
+            h.write('old')
+        os.chmod(self.path('secret'), 0600)
+        self.assertEqual(self.run_bundle(
+            cc.WriteFile(self.path('secret'), 'new'),
+            cc.WriteFile(self.path('other'), 'other')), 0)
+        self.assertEqual(os.stat(self.path('secret')).st_mode & 0777, 0600)
+        self.assertEqual(self.read('secret'), 'new\n')
+
+    def test_removes_staging_on_failure(self):
+        with open(self.path('file'), 'w') as h:
+            h.write('not a directory')
+        self.assertNotEqual(self.run_bundle(
+            cc.WriteFile(self.path('file', 'a'), 'a'),
+            cc.WriteFile(self.path('b'), 'b')), 0)
+        self.assertEqual(os.listdir(self.tmp), [])
+
+
+class TestBundleFiles(unittest.TestCase):
+    def test_all_ready_siblings_share_a_bundle(self):
+        role = Role(5)
+        decls = cc.bundle_files(set([role]) | role.subs)
+        bundled = [d for d in decls if isinstance(d, cc.Bundled)]
+        self.assertEqual(len(bundled), 5)
+        self.assertEqual(len(set(b.bundle for b in bundled)), 1)
+        self.assertEqual(len([d for d in decls if isinstance(d, cc.Bundle)]),
+                         1)
+
+    def test_bundled_keeps_name_and_sentinel(self):
+        role = Role(2)
+        for d in cc.bundle_files(set([role]) | role.subs):
+            if isinstance(d, cc.Bundled):
+                self.assertEqual(d.name, d.task.name)
+                self.assertIn(d.task.checks[0].strip(), d.decls[0])
+                self.assertIn(d.bundle.call, d.decls[0])
+
+    def test_wrapped_files_are_not_bundled(self):
+        role = Role(3)
+        wrapped = cc.CD('/tmp')(role)
+        decls = cc.bundle_files(set([wrapped, role]) | role.subs)
+        self.assertFalse([d for d in decls if isinstance(d, cc.Bundled)])
+
+    def test_subclass_changing_code_is_not_bundled(self):
+        class R(cc.Task):
+            def deps(self):
+                return [Reloaded('/etc/nginx/a', 'a'),
+                        Reloaded('/etc/nginx/b', 'b')]
+        decls = cc.bundle_files(set([R()]) | R().subs)
+        self.assertFalse([d for d in decls if isinstance(d, cc.Bundled)])
+
+    def test_single_file_is_not_bundled(self):
+        role = Role(1)
+        decls = cc.bundle_files(set([role]) | role.subs)
+        self.assertFalse([d for d in decls if isinstance(d, cc.Bundled)])
+
+
+if __name__ == '__main__':
+    unittest.main()